@@ -1,10 +1,13 @@
+import gzip
 import json
 import os
+from asyncio import create_task
 from datetime import datetime
 from logging import getLogger
 from typing import Any, TypeVar
 from urllib.parse import urlencode
 
+import numpy as np
 from aiohttp import ClientError, ClientResponse
 
 from auto_gen_playlist.lastfm.misc import AGPLException
@@ -17,18 +20,24 @@ T = TypeVar("T")
 logger = getLogger(__name__)
 
 
-async def extract_tracks(resp: ClientResponse) -> list[dict[str, Any]]:
-    res = await resp.json(encoding="utf-8")
-    if "recenttracks" in res and "track" in res["recenttracks"]:
+def _drop_now_playing(tracks: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """再生中のトラックを除いたリストを返します。該当するトラックがない場合には、リストをコピーせずそのまま返します。"""
+    if any(
+        "@attr" in track and track["@attr"].get("nowplaying") == "true"
+        for track in tracks
+    ):
         return [
             track
-            for track in res["recenttracks"]["track"]
-            if not (
-                "@attr" in track
-                and "nowplaying" in track["@attr"]
-                and track["@attr"]["nowplaying"] == "true"
-            )
+            for track in tracks
+            if not ("@attr" in track and track["@attr"].get("nowplaying") == "true")
         ]
+    return tracks
+
+
+async def extract_tracks(resp: ClientResponse) -> list[dict[str, Any]]:
+    res = await resp.json(encoding="utf-8")
+    if "recenttracks" in res and "track" in res["recenttracks"]:
+        return _drop_now_playing(res["recenttracks"]["track"])
     else:
         logger.error(
             f"Unexpected api response in extract_tracks(): await resp.json(encoding='utf-8')={res}"  # noqa: E501
@@ -36,36 +45,54 @@ async def extract_tracks(resp: ClientResponse) -> list[dict[str, Any]]:
         raise ClientError(f"Invalid API Response: await resp.json()={res}")
 
 
-async def extract_tracks_total_pages(resp: ClientResponse) -> int:
+async def extract_tracks_and_total_pages(
+    resp: ClientResponse,
+) -> tuple[list[dict[str, Any]], int]:
     res = await resp.json(encoding="utf-8")
-    if "recenttracks" in res and "@attr" in res["recenttracks"]:
-        return int(res["recenttracks"]["@attr"]["totalPages"])
+    if (
+        "recenttracks" in res
+        and "track" in res["recenttracks"]
+        and "@attr" in res["recenttracks"]
+    ):
+        return (
+            _drop_now_playing(res["recenttracks"]["track"]),
+            int(res["recenttracks"]["@attr"]["totalPages"]),
+        )
     else:
         logger.error(
-            f"Unexpected api response in extract_tracks(): await resp.json(encoding='utf-8')={res}"  # noqa: E501
+            f"Unexpected api response in extract_tracks_and_total_pages(): await resp.json(encoding='utf-8')={res}"  # noqa: E501
         )
         raise ClientError(f"Invalid API Response: await resp.json()={res}")
 
 
-def generate_tracks_url(
+def generate_tracks_url_base(
     user: str,
-    page: int = 1,
     since: datetime | None = None,
     until: datetime | None = None,
     extended: bool = True,
 ):
+    """`page`のみが異なるURLを量産できるよう、`page`を末尾に付け足すだけのURLを返します。"""
     query = {
         "method": "user.getrecenttracks",
         "limit": 200,
         "user": user,
         "api_key": os.environ["LAST_FM_API_KEY"],
-        "page": page,
         "from": int(since.timestamp()) if since is not None else "",
         "to": int(until.timestamp()) if until is not None else "",
         "extended": int(extended),
         "format": "json",
     }
-    return ROOT + urlencode(query)
+    return ROOT + urlencode(query) + "&page="
+
+
+def generate_tracks_url(
+    user: str,
+    page: int = 1,
+    since: datetime | None = None,
+    until: datetime | None = None,
+    extended: bool = True,
+):
+    return generate_tracks_url_base(user, since, until, extended) + str(page)
 
 
 async def fetch_tracks(
@@ -73,21 +100,20 @@ async def fetch_tracks(
 ):
     """指定したユーザーの`scrobbles`をすべて取得して返します。期間を指定することもできます。
     取得に失敗した場合には、空リストを返します。"""
-    max_pages = await fetch_one(
-        extract_tracks_total_pages, generate_tracks_url(user, since=since, until=until)
-    )
+    url_base = generate_tracks_url_base(user, since, until)
+    first = await fetch_one(extract_tracks_and_total_pages, url_base + "1")
 
     tracks: list[dict[str, Any]] = []
-    if max_pages is None:
+    if first is None:
         return tracks
 
+    first_tracks, max_pages = first
+    tracks.extend(first_tracks)
+
     for res in await fetch_all(
         extract_tracks,
-        [
-            generate_tracks_url(user, page, since, until)
-            for page in range(1, max_pages + 1)
-        ],
-        limit=3,
+        [url_base + str(page) for page in range(2, max_pages + 1)],
+        limit=5,
     ):
         tracks.extend(res if res is not None else [])
 
@@ -125,50 +151,98 @@ async def fetch_user_info(user: str):
         )
 
 
-def recursively_remove_elements(res: T) -> T:
-    """`res`に含まれる辞書から、`image`と`streamable`をキーとする要素を削除します。"""
-    if isinstance(res, dict):
-        return {
-            k: recursively_remove_elements(res[k])
-            for k in res.keys()  # type: ignore
-            if str(k) not in ("image", "streamable")
-        }
-    elif isinstance(res, list):
-        return [recursively_remove_elements(c) for c in res]  # type: ignore
+def remove_elements_in_place(res: T) -> T:
+    """`res`に含まれる辞書から、`image`と`streamable`をキーとする要素を破壊的に削除します。"""
+    stack: list[Any] = [res]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            node.pop("image", None)
+            node.pop("streamable", None)
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+    return res
+
+
+def load_scrobbles_cache(user: str) -> list[dict[str, Any]] | None:
+    """指定したユーザーの`scrobbles`のキャッシュを読み込んで返します。キャッシュが存在しない場合には、`None`を返します。
+    圧縮前の旧形式のキャッシュも読み込めます。"""
+    path = CACHE_DIR + f"/scrobbles/{user}.json.gz"
+    if os.path.exists(path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    legacy_path = CACHE_DIR + f"/scrobbles/{user}.json"
+    if os.path.exists(legacy_path):
+        with open(legacy_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return None
+
+
+def load_scrobbles_uts(user: str):
+    """`dump_scrobbles_cache()`が保存した`uts`の配列をメモリマップで読み込んで返します。
+    配列が存在しない場合には、`None`を返します。"""
+    path = CACHE_DIR + f"/scrobbles/{user}.uts.npy"
+    if os.path.exists(path):
+        return np.load(path, mmap_mode="r")
+    return None
+
+
+def dump_scrobbles_cache(user: str, tracks: list[dict[str, Any]]):
+    """指定したユーザーの`scrobbles`のキャッシュを`gzip`で圧縮して保存します。
+    合わせて、`uts`の列をバイナリ形式で保存します。"""
+    path = CACHE_DIR + f"/scrobbles/{user}.json.gz"
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(tracks, f, separators=(",", ":"))
+
+    try:
+        uts = np.fromiter(
+            (int(track["date"]["uts"]) for track in tracks),
+            dtype=np.int64,
+            count=len(tracks),
+        )
+    except KeyError:
+        logger.error(f"Unexpected track data in cache of '{user}', uts not saved.")
     else:
-        return res
+        np.save(CACHE_DIR + f"/scrobbles/{user}.uts.npy", uts)
+
+
+_VERIFIED_USERS: set[str] = set()
 
 
 async def fetch_tracks_all(user: str, refetch: bool = False):
     """指定したユーザーの`scrobbles`をすべて取得します。この際、データ量削減のために、一部の情報は削除します。
     取得した`scrobbles`はキャッシュとして保存して再利用しますが、`refetch=True`を指定すれば、全データを再取得します。"""
-    if res := await fetch_user_info(user) is None:
-        # check if specified user exists
-        return
-
-    path = CACHE_DIR + f"/scrobbles/{user}.json"
     since = None
+    cache = None
     if not refetch:
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                cache = json.load(f)
+        if (cache := load_scrobbles_cache(user)) is not None:
             if "date" in cache[0] and "uts" in cache[0]["date"]:
                 since = datetime.fromtimestamp(int(cache[0]["date"]["uts"]) + 1, tz=JST)
             else:
                 logger.error(
-                    f"Invalid cache data: '{path}' is maybe broken. Try refetch."
+                    f"Invalid cache data: cache of '{user}' is maybe broken. Try refetch."  # noqa: E501
                 )
                 return
 
-    res = recursively_remove_elements(await fetch_tracks(user, since))
+    # ユーザーの存在確認と scrobbles の取得を並行して開始し、確認に失敗したら取得を打ち切る
+    # 一度確認できたユーザーは同一プロセス内では再確認しない
+    tracks_task = create_task(fetch_tracks(user, since))
 
-    if not refetch:
-        if os.path.exists(path):
-            with open(path, "r", encoding="utf-8") as f:
-                res.extend(json.load(f))
+    if user not in _VERIFIED_USERS:
+        if await fetch_user_info(user) is None:
+            tracks_task.cancel()
+            return
+        _VERIFIED_USERS.add(user)
+
+    res = remove_elements_in_place(await tracks_task)
+
+    if cache is not None:
+        res.extend(cache)
 
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(res, f, indent=4)
+    dump_scrobbles_cache(user, res)
 
 
 async def get_user_history(
@@ -177,14 +251,10 @@ async def get_user_history(
     """指定したユーザーの`scrobbles`のキャッシュを返します。`update=True`を指定した場合、先にキャッシュを更新します。
     これに加えて、`refetch=True`を指定したときは、キャッシュを破棄して全データを再取得します。
     キャッシュが存在しない場合や、`scrobbles`の取得に失敗した場合には、`None`を返します。"""
-    path = CACHE_DIR + f"/scrobbles/{user}.json"
-
     if update:
         await fetch_tracks_all(user, refetch)
 
-    if os.path.exists(path):
-        with open(path, "r", encoding="utf-8") as f:
-            cache = json.load(f)
+    if (cache := load_scrobbles_cache(user)) is not None:
         return cache
 
     else:
@@ -2,23 +2,58 @@ import dataclasses
 from collections import Counter
 from datetime import datetime
 from logging import getLogger
+from sys import intern
+from typing import Any
 
+import numpy as np
 from dateutil.relativedelta import relativedelta
 
-from auto_gen_playlist.lastfm.api import get_user_history
-from auto_gen_playlist.lastfm.misc import bisect_left_with_descending
+from auto_gen_playlist.lastfm.api import get_user_history, load_scrobbles_uts
 from auto_gen_playlist.vars import JST
 
 logger = getLogger(__name__)
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class Song:
     title: str
     artist: str
     album: str
 
 
+_UTS_CACHE: dict[tuple[str, int], Any] = {}
+
+
+def _user_uts_array(user: str, tracks: list[dict[str, Any]]):
+    """`tracks`の`uts`を新しい順の`int64`配列として返します。
+    同じ履歴に対して繰り返し呼び出された場合には、構築済みの配列を再利用します。"""
+    key = (user, len(tracks))
+    if (uts := _UTS_CACHE.get(key)) is None:
+        # キャッシュと一緒に保存されたバイナリの配列があれば、パースせずにそのまま使う
+        uts = load_scrobbles_uts(user)
+        if uts is None or len(uts) != len(tracks):
+            uts = np.fromiter(
+                (int(track["date"]["uts"]) for track in tracks),
+                dtype=np.int64,
+                count=len(tracks),
+            )
+        # 履歴が更新された場合に古い配列が残らないよう、同一ユーザーの項目は入れ替える
+        for old in [k for k in _UTS_CACHE if k[0] == user]:
+            del _UTS_CACHE[old]
+        _UTS_CACHE[key] = uts
+    return uts
+
+
+def _track_range_indices(uts: Any, since_ts: int, until_ts: int) -> tuple[int, int]:
+    """`since_ts <= uts[idx] < until_ts`を満たす区間`(until_idx, since_idx)`を返します。
+    `uts`は新しい順に並んでいる必要があります。"""
+    # searchsorted は昇順を前提とするため、反転したビューで位置を求めて読み替える
+    asc = uts[::-1]
+    since_idx = len(uts) - int(np.searchsorted(asc, since_ts))
+    until_idx = len(uts) - int(np.searchsorted(asc, until_ts))
+    return until_idx, since_idx
+
+
 async def get_user_track_counter(
     user: str,
     since: datetime | None = None,
@@ -31,31 +66,26 @@ async def get_user_track_counter(
     """`since <= track["date"] < until`を満たす期間の再生回数の`Counter`を返します。"""
     tracks = await get_user_history(user, update, refetch)
 
-    since_ts = since.timestamp() if since is not None else 0
-    until_ts = until.timestamp() if until is not None else 2_220_000_000
-
-    res: list[Song] = []
+    since_ts = int(since.timestamp()) if since is not None else 0
+    until_ts = int(until.timestamp()) if until is not None else 2_220_000_000
 
-    since_idx = bisect_left_with_descending(
-        tracks, since_ts, key=lambda x: int(x["date"]["uts"])
-    )
-    until_idx = bisect_left_with_descending(
-        tracks, until_ts, key=lambda x: int(x["date"]["uts"])
+    until_idx, since_idx = _track_range_indices(
+        _user_uts_array(user, tracks), since_ts, until_ts
     )
 
-    for track in tracks[until_idx:since_idx]:
-        try:
-            res.append(
-                Song(
-                    track["name"],
-                    track["artist"]["name"],
-                    track["album"]["#text"] if not ignore_album else "",
+    def songs():
+        for track in tracks[until_idx:since_idx]:
+            try:
+                # 同じ曲名・アーティスト名が何度も現れるため、intern でオブジェクトを共有する
+                yield Song(
+                    intern(track["name"]),
+                    intern(track["artist"]["name"]),
+                    intern(track["album"]["#text"]) if not ignore_album else "",
                 )
-            )
-        except KeyError:
-            logger.error(f"Unexpected track data: {track=}")
+            except KeyError:
+                logger.error(f"Unexpected track data: {track=}")
 
-    return Counter(res)
+    return Counter(songs())
 
 
 async def get_user_two_months_track_counter(
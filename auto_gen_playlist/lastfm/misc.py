@@ -48,7 +48,6 @@ def bisect_left_with_descending(
     if key is None:
         while lo < hi:
             mid = (lo + hi) // 2
-            logger.debug(f"{lo=}, {mid=}, {hi=}")
             if a[mid] < x:  # type: ignore
                 hi = mid
             else:
@@ -3,12 +3,40 @@ from collections.abc import Awaitable, Callable
 from logging import getLogger
 from typing import Any, TypeVar
 
-from aiohttp import ClientError, ClientResponse, ClientSession, TCPConnector
+from aiohttp import (
+    ClientError,
+    ClientResponse,
+    ClientResponseError,
+    ClientSession,
+    TCPConnector,
+)
 
 T = TypeVar("T")
 
 logger = getLogger(__name__)
 
+_SESSION: ClientSession | None = None
+
+
+async def get_session() -> ClientSession:
+    """モジュール共通の`ClientSession`を返します。初回呼び出し時に生成し、以降は同一のセッションを再利用します。"""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = ClientSession(
+            connector=TCPConnector(
+                ssl=False, limit=64, limit_per_host=8, keepalive_timeout=75
+            )
+        )
+    return _SESSION
+
+
+async def close_session():
+    """`get_session()`が生成したセッションを閉じます。アプリケーションの終了時に呼び出してください。"""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
 
 async def _fetch(
     session: ClientSession,
@@ -17,10 +45,17 @@ async def _fetch(
     *args: Any,
     **kwargs: Any,
 ) -> T | None:
-    for _ in range(5):
+    for attempt in range(5):
         try:
             resp = await session.get(url, *args, **kwargs)
             resp.raise_for_status()
+        except ClientResponseError as err:
+            logger.error(f"session.get({url=}, {args=}, {kwargs=}) failed: {err}")
+            if err.status == 429 and err.headers and "Retry-After" in err.headers:
+                await sleep(float(err.headers["Retry-After"]))
+            else:
+                # レート制限などの一時的なエラーを想定して、指数的に間隔を延ばして再試行する
+                await sleep(2.0 * 2**attempt)
         except ClientError as err:
             logger.error(f"session.get({url=}, {args=}, {kwargs=}) failed: {err}")
             await sleep(2.0)
@@ -56,19 +91,18 @@ async def fetch_all(
     tasks: list[Task[T | None]] = []
     semaphore = Semaphore(limit)
 
-    async with ClientSession(connector=TCPConnector(ssl=False)) as session:
-        for url in urls:
-            task = create_task(
-                _fetch_with_semaphore(semaphore, session, coro, url, *args, **kwargs)
-            )
-            tasks.append(task)
-        responses = await gather(*tasks)
-        return responses
+    session = await get_session()
+    for url in urls:
+        task = create_task(
+            _fetch_with_semaphore(semaphore, session, coro, url, *args, **kwargs)
+        )
+        tasks.append(task)
+    responses = await gather(*tasks)
+    return responses
 
 
 async def fetch_one(
     coro: Callable[[ClientResponse], Awaitable[T]], url: str, *args: Any, **kwargs: Any
 ) -> T | None:
     """`fetch_all()`の単独実行版のコルーチン関数です。"""
-    async with ClientSession(connector=TCPConnector(ssl=False)) as session:
-        return await _fetch(session, coro, url, *args, **kwargs)
+    return await _fetch(await get_session(), coro, url, *args, **kwargs)
@@ -1,6 +1,9 @@
 from logging import getLogger
 
+import requests
+from requests.adapters import HTTPAdapter
 from spotipy import Spotify
+from spotipy.oauth2 import SpotifyOAuth
 
 from .ft import Features, fetch_audio_features_all, sort_by_similarity
 from .playlist import (
@@ -8,14 +11,23 @@ from .playlist import (
     playlist_fetch_songs_all,
     playlist_remove_songs_all,
 )
+from .utils import get_me
 
 logger = getLogger(__name__)
 
 
+def create_spotify_client(scope: str) -> Spotify:
+    """接続プールを持つ`requests.Session`を共有する`Spotify`クライアントを生成します。
+    すべてのAPI呼び出しが同一のkeep-alive接続を再利用します。"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+    return Spotify(auth_manager=SpotifyOAuth(scope=scope), requests_session=session)
+
+
 def playlist_sort_by_features(sp: Spotify, id: str, feature: Features):
     """指定したプレイリストの曲を`feature`の数値に従って降順で並び替えます。"""
 
-    user = sp.me()
+    user = get_me(sp)
     uris = playlist_fetch_songs_all(sp, id)
 
     fts = fetch_audio_features_all(sp, uris)
@@ -54,9 +66,9 @@ def fetch_recommendation(
     else:
         load = {}
 
-    sort_by_similarity(fts, idx, [ft for ft in Features])  # type: ignore
+    seeds = sort_by_similarity(fts, idx, [ft for ft in Features], top_k=5)
 
     res = sp.recommendations(
-        seed_tracks=[ft["uri"] for ft in fts[:5]], limit=count, **load  # type: ignore
+        seed_tracks=[ft["uri"] for ft in seeds], limit=count, **load  # type: ignore
     )
     return [track["uri"] for track in res["tracks"]]  # type: ignore
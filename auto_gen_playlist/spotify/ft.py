@@ -1,14 +1,23 @@
+import json
+import os
 from enum import Enum
+from operator import itemgetter
 from logging import getLogger
 from typing import Any
 
-from scipy import spatial, stats
+import numpy as np
 from spotipy import Spotify
 
-from .utils import automatic_retry
+from auto_gen_playlist.vars import CACHE_DIR
+
+from .utils import automatic_retry, map_concurrently
 
 logger = getLogger(__name__)
 
+FT_CACHE_PATH = CACHE_DIR + "/audio_features.json"
+
+_FT_CACHE: dict[str, dict[str, Any]] | None = None
+
 
 class Features(Enum):
     # cf. https://developer.spotify.com/documentation/web-api/reference/#/operations/get-several-audio-features  # noqa: E501
@@ -23,6 +32,24 @@ class Features(Enum):
     VALENCE = "valence"
 
 
+def _load_ft_cache() -> dict[str, dict[str, Any]]:
+    """`audio features`のディスクキャッシュを読み込んで返します。初回以降はメモリ上のキャッシュを返します。"""
+    global _FT_CACHE
+    if _FT_CACHE is None:
+        if os.path.exists(FT_CACHE_PATH):
+            with open(FT_CACHE_PATH, "r", encoding="utf-8") as f:
+                _FT_CACHE = json.load(f)
+        else:
+            _FT_CACHE = {}
+    return _FT_CACHE
+
+
+def _save_ft_cache():
+    if _FT_CACHE is not None:
+        with open(FT_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump(_FT_CACHE, f, separators=(",", ":"))
+
+
 @automatic_retry
 def audio_features(sp: Spotify, ids: list[str]) -> list[dict[str, Any] | None]:
     # cf. https://developer.spotify.com/documentation/web-api/reference/#/operations/get-several-audio-features  # noqa: E501
@@ -32,19 +59,26 @@ def audio_features(sp: Spotify, ids: list[str]) -> list[dict[str, Any] | None]:
 
 def fetch_audio_features_all(sp: Spotify, ids: list[str]) -> list[dict[str, Any]]:
     """渡したトラックの`audio features`をすべて取得して返します。渡される`id`は全て有効なものである必要があります。
+    `audio features`は不変であるため、一度取得したものはディスクにキャッシュして再利用します。
     取得に失敗した場合は、空リストを返します。"""
 
-    fetched = 0
-    fts: list[dict[str, Any] | None] = []
+    cache = _load_ft_cache()
+    missing = [id for id in ids if id not in cache]
+    chunks = [missing[i : i + 100] for i in range(0, len(missing), 100)]
 
-    while fetched < len(ids):
-        if res := audio_features(sp, ids[fetched : fetched + 100]):
-            fts.extend(res)
-            fetched += 100
-        else:
+    results = map_concurrently(lambda chunk: audio_features(sp, chunk), chunks)
+
+    for chunk, res in zip(chunks, results):
+        if not res:
             return []
+        for id, ft in zip(chunk, res):
+            cache[id] = ft if ft is not None else {}
+
+    if missing:
+        _save_ft_cache()
 
-    return [ft if ft is not None else {} for ft in fts]
+    # キャッシュ上の辞書が呼び出し側の変更で汚れないよう、コピーを返す
+    return [dict(cache[id]) for id in ids]
 
 
 def sort_by_features(sp: Spotify, uris: list[str], feature: Features) -> list[str]:
@@ -58,18 +92,33 @@ def sort_by_features(sp: Spotify, uris: list[str], feature: Features) -> list[st
 
 
 def sort_by_similarity(
-    result: list[dict[str, Any]], idx: int, features: list[Features]
+    result: list[dict[str, Any]],
+    idx: int,
+    features: list[Features],
+    top_k: int | None = None,
 ):
     """トラックの`audio_features`を、`key`に含まれる指標の標準得点をもとにして、
-    `idx`個目のトラックとのユークリッド距離が近い順に並び替えます。"""
-
-    res = []
-    for track in result:
-        res.append([track[f.value] for f in features])
-    z_list = stats.zscore(res, ddof=1)  # type: ignore
-
-    for i in range(len(res)):
-        result[i]["metric"] = spatial.distance.euclidean(z_list[i], z_list[idx])
-
-    result.sort(key=lambda x: x["metric"])
+    `idx`個目のトラックとのユークリッド距離が近い順に並び替えます。
+    `top_k`を指定した場合には、全体を並び替えずに上位`top_k`個だけを選んで返します。"""
+
+    # Enum の .value 参照を行ごとに繰り返さないよう、キーの取り出しを C 実装に任せる
+    getter = itemgetter(*(f.value for f in features))
+    arr = np.empty((len(result), len(features)), dtype=np.float32)
+    for i, track in enumerate(result):
+        arr[i] = getter(track)
+    # scipy.stats.zscore(ddof=1) と同じ標準得点を numpy だけで計算する
+    z_list = (arr - arr.mean(axis=0)) / arr.std(axis=0, ddof=1)
+
+    # 距離の大小関係のみが必要なため、平方根は取らずに二乗距離のまま比較する。
+    # |a-b|^2 = |a|^2 + |b|^2 - 2ab の展開により、差分行列を作らずに行列ベクトル積だけで済ませる
+    norms = np.einsum("ij,ij->i", z_list, z_list)
+    dists = norms + norms[idx] - 2.0 * (z_list @ z_list[idx])
+
+    if top_k is not None and top_k < len(result):
+        # 上位 top_k 個だけが必要なときは、全体の並び替えを避けて部分選択する
+        order = np.argpartition(dists, top_k)[:top_k]
+        order = order[np.argsort(dists[order], kind="stable")]
+        return [result[i] for i in order]
+
+    result[:] = [result[i] for i in np.argsort(dists, kind="stable")]
     return result
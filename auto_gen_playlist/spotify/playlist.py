@@ -3,7 +3,7 @@ from typing import Any, NamedTuple, ParamSpec, TypeVar
 
 from spotipy import Spotify, SpotifyException
 
-from .utils import AGPException, automatic_retry
+from .utils import AGPException, automatic_retry, map_concurrently
 
 T = TypeVar("T")
 P = ParamSpec("P")
@@ -16,34 +16,62 @@ class Playlist(NamedTuple):
     uri: str
 
 
+# 取得する要素をサーバー側で絞り込み、レスポンスサイズと後処理を削減する
+_SONGS_FIELDS = "total,limit,items(track(uri,type,name))"
+
+
 @automatic_retry
-def _playlist_items(sp: Spotify, id: str, offset: int = 0) -> dict[str, Any]:
+def _playlist_items(
+    sp: Spotify, id: str, offset: int = 0, fields: str | None = None
+) -> dict[str, Any]:
     # cf. https://developer.spotify.com/documentation/web-api/reference/#/operations/get-playlists-tracks  # noqa: E501
 
     try:
-        return sp.playlist_items(playlist_id=id, limit=50, offset=offset)  # type: ignore # noqa: E501
+        return sp.playlist_items(playlist_id=id, fields=fields, limit=100, offset=offset)  # type: ignore # noqa: E501
     except SpotifyException as err:
         if "Invalid playlist Id" in str(err):
             raise AGPException(f"Invalid playlist id: {id=}, process skipped.")
         raise
 
 
-def playlist_fetch_songs_all(sp: Spotify, id: str) -> list[str]:
-    """プレイリストに含まれる`track`をすべて取得してその`uri`のリストを返します。"""
+def playlist_fetch_tracks_all(sp: Spotify, id: str) -> list[dict[str, Any]]:
+    """プレイリストに含まれる`track`(`uri`と`name`のみ)をすべて取得して返します。
+    最初のページで`total`が判明するため、残りのページは並行して取得します。
+    いずれかのページの取得に失敗した場合には、`AGPException`を送出します。"""
 
-    fetched, total = 0, 1
-    uris: list[str] = []
+    first = _playlist_items(sp, id, 0, _SONGS_FIELDS)
+    if first is None:
+        raise AGPException(f"Failed to fetch playlist items: {id=}.")
 
-    while fetched < total:
-        res = _playlist_items(sp, id, fetched)
-        total: int = res["total"]  # type: ignore
-        fetched: int = fetched + res["limit"]  # type: ignore
+    total: int = first["total"]
+    limit: int = first["limit"]
 
-        for item in res["items"]:  # type: ignore
-            if "track" in item and item["track"]["type"] == "track":
-                uris.append(item["track"]["uri"])
+    pages = [first]
+    if total > limit:
+        pages += map_concurrently(
+            lambda offset: _playlist_items(sp, id, offset, _SONGS_FIELDS),
+            range(limit, total, limit),
+        )
 
-    return uris
+    # total が既知のため、ページごとの extend ではなく確保済みのリストにスライスで書き込む
+    items: list[Any] = [None] * total
+    for i, res in enumerate(pages):
+        if res is None:
+            # 欠けたページを黙って飛ばすと、再追加や並び替えが不完全なデータの上で走ってしまう
+            raise AGPException(f"Failed to fetch playlist items: {id=}, page {i+1}.")
+        items[i * limit : i * limit + len(res["items"])] = res["items"]
+
+    return [
+        item["track"]
+        for item in items
+        if item is not None and "track" in item and item["track"]["type"] == "track"
+    ]
+
+
+def playlist_fetch_songs_all(sp: Spotify, id: str) -> list[str]:
+    """プレイリストに含まれる`track`をすべて取得してその`uri`のリストを返します。"""
+
+    return [track["uri"] for track in playlist_fetch_tracks_all(sp, id)]
 
 
 @automatic_retry
@@ -85,17 +113,28 @@ def _user_playlist(sp: Spotify, offset: int) -> dict[str, Any]:
 
 
 def user_fetch_playlists_all(sp: Spotify):
-    """ユーザーのプレイリストをすべて取得して返します。"""
+    """ユーザーのプレイリストをすべて取得して返します。2ページ目以降は並行して取得します。
+    いずれかのページの取得に失敗した場合には、`AGPException`を送出します。"""
 
-    fetched, total = 0, 1
-    pls: list[Playlist] = []
+    first = _user_playlist(sp, 0)
+    if first is None:
+        raise AGPException("Failed to fetch user playlists.")
+
+    total: int = first["total"]
+    limit: int = first["limit"]
 
-    while fetched < total:
-        res = _user_playlist(sp, fetched)
-        total: int = res["total"]  # type: ignore
-        fetched: int = fetched + res["limit"]  # type: ignore
+    pages = [first]
+    if total > limit:
+        pages += map_concurrently(
+            lambda offset: _user_playlist(sp, offset), range(limit, total, limit)
+        )
 
-        for item in res["items"]:  # type: ignore
+    pls: list[Playlist] = []
+    for i, res in enumerate(pages):
+        if res is None:
+            # 一覧が欠けると既存のプレイリストを見落として重複作成につながるため、中断する
+            raise AGPException(f"Failed to fetch user playlists: page {i+1}.")
+        for item in res["items"]:
             pls.append(Playlist(item["name"], item["uri"]))
 
     return pls
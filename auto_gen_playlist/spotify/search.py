@@ -1,13 +1,20 @@
+import json
+import os
 from logging import getLogger
+from threading import Lock
 from typing import Any, TypeVar
 
 from spotipy import Spotify
 
-from .utils import AGPException, automatic_retry
+from auto_gen_playlist.vars import CACHE_DIR
+
+from .utils import AGPException, automatic_retry, map_concurrently
 
 T = TypeVar("T")
 logger = getLogger(__name__)
 
+TRACK_CACHE_PATH = CACHE_DIR + "/spotify_search.json"
+
 
 @automatic_retry
 def _search_track(sp: Spotify, query: str = "") -> list[dict[str, Any]]:
@@ -20,6 +27,50 @@ def _search_track(sp: Spotify, query: str = "") -> list[dict[str, Any]]:
         raise AGPException(f"Unexpected API response in search_track({query=}): {res=}")
 
 
+def _search_track_with_language(sp: Spotify, query: str, language: str):
+    """指定した言語で`_search_track()`を実行します。`sp.language`は状態を持つため、
+    認証情報とセッションを共有する言語ごとのクライアントを使って検索します。"""
+    client = Spotify(auth_manager=sp.auth_manager, requests_session=sp._session)
+    client.language = language
+    return _search_track(client, query=query)
+
+
+_TRACK_CACHE: dict[str, str | None] | None = None
+_TRACK_CACHE_DIRTY = False
+
+# 検索はスレッドプールからも呼ばれるため、キャッシュの読み書きはロックで直列化する
+_TRACK_CACHE_LOCK = Lock()
+
+
+def _load_track_cache() -> dict[str, str | None]:
+    """検索結果のディスクキャッシュを読み込んで返します。初回以降はメモリ上のキャッシュを返します。
+    `_TRACK_CACHE_LOCK`を取得した状態で呼び出してください。"""
+    global _TRACK_CACHE
+    if _TRACK_CACHE is None:
+        if os.path.exists(TRACK_CACHE_PATH):
+            with open(TRACK_CACHE_PATH, "r", encoding="utf-8") as f:
+                _TRACK_CACHE = json.load(f)
+        else:
+            _TRACK_CACHE = {}
+    return _TRACK_CACHE
+
+
+def _save_track_cache():
+    """未保存の追加がある場合に、キャッシュをディスクに書き出します。
+    `_TRACK_CACHE_LOCK`を取得した状態で呼び出してください。"""
+    global _TRACK_CACHE_DIRTY
+    if _TRACK_CACHE is not None and _TRACK_CACHE_DIRTY:
+        with open(TRACK_CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump(_TRACK_CACHE, f, ensure_ascii=False, separators=(",", ":"))
+        _TRACK_CACHE_DIRTY = False
+
+
+# select() が返す一致度
+_SCORE_NONE = 0
+_SCORE_PARTIAL = 1
+_SCORE_EXACT = 2
+
+
 def find_track_in_spotify(sp: Spotify, title: str, artist: str) -> str | None:
     """`Spotify`から指定した曲の`id`を検索して返します。候補が複数ある場合、
 
@@ -28,36 +79,85 @@ def find_track_in_spotify(sp: Spotify, title: str, artist: str) -> str | None:
     1. なければ指定した`artist`の広義のアルバムの中で最も曲数が多いものに含まれる曲
     1. いずれもなければ検索結果で最上位にきた曲
 
-    の`uri`を返します。指定した曲名とアーティスト名に完全一致する曲がない場合、`None`を返します。"""
-
-    def select(results: list[dict[str, Any]]) -> str | None:
+    の`uri`を返します。指定した曲名とアーティスト名に完全一致する曲がない場合、`None`を返します。
+    検索結果は`(title, artist)`ごとにディスクにキャッシュして、プロセスをまたいで再利用します。"""
+    uri = _lookup_track(sp, title, artist)
+    with _TRACK_CACHE_LOCK:
+        _save_track_cache()
+    return uri
+
+
+def find_tracks_in_spotify(
+    sp: Spotify, songs: list[tuple[str, str]]
+) -> list[str | None]:
+    """`(title, artist)`のリストをまとめて並行に検索して、`uri`を元の順序で返します。
+    ディスクへの保存は、全件の検索が終わった後に一度だけ行います。"""
+    results = map_concurrently(lambda song: _lookup_track(sp, *song), songs)
+    with _TRACK_CACHE_LOCK:
+        _save_track_cache()
+    return results
+
+
+def _lookup_track(sp: Spotify, title: str, artist: str) -> str | None:
+    """キャッシュを参照しつつ1曲を検索します。結果はメモリ上のキャッシュにのみ反映します。"""
+    global _TRACK_CACHE_DIRTY
+    key = "\x1f".join((title.casefold(), artist.casefold()))
+
+    with _TRACK_CACHE_LOCK:
+        cache = _load_track_cache()
+        if key in cache:
+            return cache[key]
+
+    # API呼び出しはロックの外で行い、他スレッドの検索を塞がないようにする
+    uri, cacheable = _find_track_in_spotify(sp, title, artist)
+
+    # 検索自体に失敗した場合の None を保存すると、以降のプロセスでも「曲が存在しない」と
+    # 誤認し続けてしまうため、確定した結果だけをキャッシュする
+    if cacheable:
+        with _TRACK_CACHE_LOCK:
+            cache[key] = uri
+            _TRACK_CACHE_DIRTY = True
+    return uri
+
+
+def _find_track_in_spotify(
+    sp: Spotify, title: str, artist: str
+) -> tuple[str | None, bool]:
+    """1曲を検索して`(uri, キャッシュ可能か)`を返します。`automatic_retry`が`None`を返した
+    (検索リクエスト自体に失敗した)場合には、結果が確定していないためキャッシュ不可とします。"""
+    title_cf = title.casefold()
+    artist_cf = artist.casefold()
+
+    def select(results: list[dict[str, Any]]) -> tuple[str | None, int]:
         album_idx: int | None = None
         suspected_ep_idx = 0
         max_total = 0
+        score = _SCORE_EXACT
 
         matched: list[dict[str, Any]] = []
 
+        # 曲名の casefold は複数の走査で使うため、先にまとめて計算しておく
+        candidates = [(track, track["name"].casefold()) for track in results]
+
         # まず完全一致する曲を探す
-        for track in results:
-            if track["name"].casefold() == title.casefold():
+        for track, name_cf in candidates:
+            if name_cf == title_cf:
                 for track_artist in track["artists"]:
-                    if track_artist["name"].casefold() == artist.casefold():
+                    if track_artist["name"].casefold() == artist_cf:
                         matched.append(track)
                         break
 
         # なければ、名称の一部を含む・一部が含まれる曲を探す
         if matched == []:
-            for track in results[:10]:
-                title_match = (
-                    track["name"].casefold() in title.casefold()
-                    or title.casefold() in track["name"].casefold()
-                )
+            score = _SCORE_PARTIAL
+            for track, name_cf in candidates[:10]:
+                title_match = name_cf in title_cf or title_cf in name_cf
 
                 artist_match = False
                 for track_artist in track["artists"]:
                     if (
-                        track_artist["name"].casefold() in artist.casefold()
-                        or artist.casefold() in track_artist["name"].casefold()
+                        track_artist["name"].casefold() in artist_cf
+                        or artist_cf in track_artist["name"].casefold()
                     ):
                         artist_match = True
                         break
@@ -71,8 +171,8 @@ def find_track_in_spotify(sp: Spotify, title: str, artist: str) -> str | None:
                 album_artist_match = False
                 for album_artist in track["album"]["artists"]:
                     if (
-                        album_artist["name"].casefold() in artist.casefold()
-                        or artist.casefold() in album_artist["name"].casefold()
+                        album_artist["name"].casefold() in artist_cf
+                        or artist_cf in album_artist["name"].casefold()
                     ):
                         album_artist_match = True
                         break
@@ -89,19 +189,32 @@ def find_track_in_spotify(sp: Spotify, title: str, artist: str) -> str | None:
                 matched[album_idx]["uri"]
                 if album_idx is not None
                 else matched[suspected_ep_idx]["uri"]
-            )
+            ), score
 
         else:
-            return None
+            return None, _SCORE_NONE
+
+    query = " ".join((title, artist))
+
+    ja_id, ja_score = None, _SCORE_NONE
+    ja_res = _search_track_with_language(sp, query, "ja")
+    if ja_res:
+        ja_id, ja_score = select(ja_res)
+
+    # 完全一致が取れた場合には、en の検索自体を省略する
+    if ja_score == _SCORE_EXACT:
+        return ja_id, True
+
+    en_id, en_score = None, _SCORE_NONE
+    en_res = _search_track_with_language(sp, query, "en")
+    if en_res:
+        en_id, en_score = select(en_res)
 
-    sp.language = "ja"
-    if ja_res := _search_track(sp, query=" ".join((title, artist))):
-        if id := select(ja_res):
-            return id
+    # automatic_retry の失敗は None、ヒットなしは空リストとして区別される。
+    # 失敗した側の検索がより良い候補を返した可能性があるため、両方の結果が揃ったときだけ確定とみなす
+    cacheable = ja_res is not None and en_res is not None
 
-    sp.language = "en"
-    if en_res := _search_track(sp, query=" ".join((title, artist))):
-        if id := select(en_res):
-            return id
+    if en_score == _SCORE_EXACT:
+        return en_id, cacheable
 
-    return None
+    return ja_id if ja_id is not None else en_id, cacheable
@@ -1,34 +1,87 @@
-from collections.abc import Callable
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from logging import getLogger
+from random import uniform
+from threading import BoundedSemaphore
 from time import sleep
-from typing import ParamSpec, TypeVar
+from typing import Any, ParamSpec, TypeVar
 
-from spotipy import SpotifyException
+from spotipy import Spotify, SpotifyException
 
 T = TypeVar("T")
+S = TypeVar("S")
 P = ParamSpec("P")
 
 logger = getLogger(__name__)
 
+# Spotifyのレート制限を踏まえて、プロセス全体の同時リクエスト数をこの値に抑える
+_MAX_CONCURRENCY = 8
+_CONCURRENCY_LIMIT = BoundedSemaphore(_MAX_CONCURRENCY)
+
+
+def map_concurrently(func: Callable[[S], T], items: Iterable[S]) -> list[T]:
+    """`func`を`items`のそれぞれに対してスレッドプールで並行に適用し、元の順序で結果を返します。
+    要素が1つ以下の場合には、スレッドを立てずにそのまま実行します。
+    同時実行数は、呼び出し元をまたいで`_MAX_CONCURRENCY`に制限されます。"""
+    items = list(items)
+    if len(items) <= 1:
+        return [func(item) for item in items]
+
+    def limited(item: S) -> T:
+        with _CONCURRENCY_LIMIT:
+            return func(item)
+
+    with ThreadPoolExecutor(max_workers=min(_MAX_CONCURRENCY, len(items))) as executor:
+        return list(executor.map(limited, items))
+
 
 class AGPException(Exception):
     pass
 
 
 def automatic_retry(func: Callable[P, T]) -> Callable[P, T | None]:
-    """関数が`SpotifyException`を送出した場合に、クールダウンを入れて自動的に再試行します。3回失敗したときは、`None`を返します。"""
+    """関数が`SpotifyException`を送出した場合に、クールダウンを入れて自動的に再試行します。3回失敗したときは、`None`を返します。
+    クールダウンは試行ごとに指数的に延ばして揺らぎを加えますが、レート制限時には`Retry-After`の指定を優先します。
+    レート制限以外の4xxは再試行しても成功しないため、すぐに`None`を返します。"""
 
     @wraps(func)
     def inner(*args: P.args, **kwargs: P.kwargs):
-        for _ in range(3):
+        for attempt in range(3):
             try:
                 return func(*args, **kwargs)
             except SpotifyException as err:
                 logger.error(f"{func.__name__}({args=}, {kwargs=}) failed: {err}")
-                sleep(1.5)
+                if (
+                    err.http_status is not None
+                    and 400 <= err.http_status < 500
+                    and err.http_status != 429
+                ):
+                    logger.error(
+                        f"{func.__name__} failed with client error"
+                        f" {err.http_status}, not retried. Process skipped."
+                    )
+                    return None
+                if (
+                    err.http_status == 429
+                    and err.headers
+                    and "Retry-After" in err.headers
+                ):
+                    sleep(float(err.headers["Retry-After"]) + uniform(0.0, 0.5))
+                else:
+                    sleep(1.5 * 2**attempt + uniform(0.0, 0.5))
         logger.error(
             f"{func.__name__}({args=}, {kwargs=}) failed for 3 times. Process skipped."
         )
 
     return inner
+
+
+_ME_CACHE: dict[int, Any] = {}
+
+
+def get_me(sp: Spotify) -> Any:
+    """`sp.me()`の結果をクライアントごとにキャッシュして返します。同一プロセス内では変化しないためです。"""
+    if id(sp) not in _ME_CACHE:
+        _ME_CACHE[id(sp)] = sp.me()
+    return _ME_CACHE[id(sp)]
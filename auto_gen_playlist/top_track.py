@@ -1,4 +1,6 @@
 import os
+from asyncio import Task, create_task
+from collections import Counter, deque
 from datetime import datetime, timedelta
 from logging import getLogger
 from random import randint
@@ -12,14 +14,15 @@ from auto_gen_playlist.lastfm.core import Song
 from . import lastfm
 from .lastfm import api
 from .spotify.core import fetch_recommendation
-from .spotify.ft import Features, sort_by_features
+from .spotify.ft import Features, fetch_audio_features_all, sort_by_features
 from .spotify.playlist import (
     playlist_add_songs_all,
-    playlist_fetch_songs_all,
+    playlist_fetch_tracks_all,
     playlist_remove_songs_all,
     user_fetch_playlists_all,
 )
-from .spotify.search import find_track_in_spotify
+from .spotify.search import find_track_in_spotify, find_tracks_in_spotify
+from .spotify.utils import get_me
 from .vars import JST
 
 logger = getLogger(__name__)
@@ -27,21 +30,47 @@ logger = getLogger(__name__)
 TRACK_COUNT = 45
 
 
+def _rotate_randomly(uris: list[str]) -> list[str]:
+    """リストをランダムな位置で回転したものを返します。"""
+    rotated = deque(uris)
+    rotated.rotate(-randint(0, len(uris) - 1))
+    return list(rotated)
+
+
 async def fetch_two_months_top_tracks(
-    sp: Spotify, year: int, month: int, update: bool = False, refetch: bool = False
+    sp: Spotify,
+    year: int,
+    month: int,
+    update: bool = False,
+    refetch: bool = False,
+    *,
+    counter: "Counter[Song] | None" = None,
 ):
-    """ユーザーの2か月間の再生回数上位曲のうち、Spotifyにあるトラックの`uri`を`TRACK_COUNT`個まで返します。"""
-    counter = await lastfm.get_user_two_months_track_counter(
-        os.environ["LAST_FM_USER_NAME"],
-        year,
-        month,
-        update=update,
-        refetch=refetch,
+    """ユーザーの2か月間の再生回数上位曲のうち、Spotifyにあるトラックの`uri`を`TRACK_COUNT`個まで返します。
+    計算済みの`counter`を渡した場合には、それをそのまま利用します。"""
+    if counter is None:
+        counter = await lastfm.get_user_two_months_track_counter(
+            os.environ["LAST_FM_USER_NAME"],
+            year,
+            month,
+            update=update,
+            refetch=refetch,
+        )
+
+    # 大半の曲は見つかるため、上位の候補をまとめて並行に検索しておく
+    tracks = [track for track, _ in counter.most_common()]
+    prefetched = find_tracks_in_spotify(
+        sp, [(track.title, track.artist) for track in tracks[: 2 * TRACK_COUNT]]
     )
 
     uris: set[str] = set()
-    for track, _ in counter.most_common():
-        if uri := find_track_in_spotify(sp, track.title, track.artist):
+    for i, track in enumerate(tracks):
+        uri = (
+            prefetched[i]
+            if i < len(prefetched)
+            else find_track_in_spotify(sp, track.title, track.artist)
+        )
+        if uri:
             uris.add(uri)
         else:
             logger.info(f"Failed to find {track.artist} - {track.title}, song skipped.")
@@ -116,20 +145,45 @@ async def generate_bimestrial_top_track_playlist(
 
     pls = user_fetch_playlists_all(sp)
 
+    # 対象の期間を先に列挙して、必要な期間の集計をまとめて開始しておく
+    periods: list[datetime] = []
     while since < datetime.now(tz=JST):
+        periods.append(since)
+        since = since + relativedelta(months=2)
+
+    counter_tasks: "dict[datetime, Task[Counter[Song]]]" = {}
+    for period in periods:
+        name = f"{period.year}{period.month:02}_Top Tracks {period.year}_#{period.month//2+1}"  # noqa: E501
+        if not update_old and name in [pl.name for pl in pls]:
+            continue
+        counter_tasks[period] = create_task(
+            lastfm.get_user_two_months_track_counter(
+                os.environ["LAST_FM_USER_NAME"], period.year, period.month
+            )
+        )
+
+    # まず各期間の上位曲を確定し、audio features は全期間分をまとめて一度に取得する
+    period_uris: dict[datetime, list[str]] = {}
+    for since, counter_task in counter_tasks.items():
+        period_uris[since] = await fetch_two_months_top_tracks(
+            sp, since.year, since.month, counter=await counter_task
+        )
+
+    all_uris = list(dict.fromkeys(uri for uris in period_uris.values() for uri in uris))
+    if all_uris:
+        fetch_audio_features_all(sp, all_uris)
+
+    user: Any = get_me(sp)
+
+    for since, uris in period_uris.items():
         name = (
             f"{since.year}{since.month:02}_Top Tracks {since.year}_#{since.month//2+1}"
         )
         description = f"created by auto_gen_playlist on {datetime.now().strftime('%Y/%m/%d %H:%M')}"  # noqa: E501
 
         target_pl = None
-        user = sp.me()
 
-        if not update_old:
-            if name in [pl.name for pl in pls]:
-                since = since + relativedelta(months=2)
-                continue
-        else:
+        if update_old:
             for pl in [pl for pl in pls if pl.name == name]:
                 target_pl = sp.playlist(pl.uri)
                 playlist_remove_songs_all(sp, target_pl["uri"])
@@ -141,43 +195,35 @@ async def generate_bimestrial_top_track_playlist(
                 user["id"], name, public=False, description=description
             )
 
-        uris = await fetch_two_months_top_tracks(sp, since.year, since.month)
-
         if len(uris) == 0:
             logger.error(
                 "No listening data available in specified period ({0}/{1:02} - {0}/{2:02}), process skipped.".format(  # noqa: E501
                     since.year, since.month, since.month + 1
                 )
             )
-            since = since + relativedelta(months=2)
             continue
 
-        uris = sort_by_features(sp, uris, Features.BPM)
-        num = randint(0, len(uris) - 1)
-        uris = uris[num:] + uris[:num]
+        # キャッシュが温まっているため、ここでの並び替えは追加のAPI呼び出しを伴わない
+        uris = _rotate_randomly(sort_by_features(sp, uris, Features.BPM))
 
-        user: Any = sp.me()
         playlist_add_songs_all(sp, target_pl["uri"], uris)
 
-        since = since + relativedelta(months=2)
-
 
 def generate_recommended_playlist(sp: Spotify, playlist_id: str, idx: int):
     """指定したプレイリストとその中の一曲から新たにプレイリストを作成します。"""
 
-    seed_songs = playlist_fetch_songs_all(sp, playlist_id)
-    uris = fetch_recommendation(sp, seed_songs, [], idx - 1, 25)
-    num = randint(0, len(uris) - 1)
-    uris = uris[num:] + uris[:num]
+    seed_tracks = playlist_fetch_tracks_all(sp, playlist_id)
+    seed_songs = [track["uri"] for track in seed_tracks]
+    uris = _rotate_randomly(fetch_recommendation(sp, seed_songs, [], idx - 1, 25))
 
     seed_pl = sp.playlist(playlist_id)
 
-    user: Any = sp.me()
+    user: Any = get_me(sp)
     pl: Any = sp.user_playlist_create(
         user["id"],
         datetime.now().strftime("%Y%m_auto-gen-playlist_#%d%S"),
         public=False,
-        description=f"seed playlist: {seed_pl['name']}, seed song: {sp.track(seed_songs[idx-1])['name']}",  # type: ignore  # noqa: E501
+        description=f"seed playlist: {seed_pl['name']}, seed song: {seed_tracks[idx-1]['name']}",  # noqa: E501
     )
 
     playlist_add_songs_all(sp, pl["id"], uris)
@@ -202,7 +248,7 @@ async def generate_first_listened_songs_in_year_playlist(
         description = f"created by auto_gen_playlist on {datetime.now().strftime('%Y/%m/%d %H:%M')}"  # noqa: E501
 
         target_pl = None
-        user: Any = sp.me()
+        user: Any = get_me(sp)
 
         if not update_old:
             if name in [pl.name for pl in pls]:
@@ -231,9 +277,7 @@ async def generate_first_listened_songs_in_year_playlist(
             since_year += 1
             continue
 
-        uris = sort_by_features(sp, uris, Features.BPM)
-        num = randint(0, len(uris) - 1)
-        uris = uris[num:] + uris[:num]
+        uris = _rotate_randomly(sort_by_features(sp, uris, Features.BPM))
 
         playlist_add_songs_all(sp, target_pl["uri"], uris)
         since_year += 1
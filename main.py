@@ -1,10 +1,18 @@
 import asyncio
+import sys
 from logging import Filter, LogRecord, config
 
 import dotenv
-import spotipy
-from yaml import safe_load
+from yaml import load as yaml_load
 
+try:
+    # LibYAML 由来のCローダーがあれば、純Python実装より大幅に速いのでそちらを使う
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+from auto_gen_playlist.lastfm.requests import close_session
+from auto_gen_playlist.spotify.core import create_spotify_client
 from auto_gen_playlist.top_track import (
     generate_bimestrial_top_track_playlist,
     generate_first_listened_songs_in_year_playlist,
@@ -18,22 +26,33 @@ SCOPE = (
 )
 
 
+# コンソールに流さないロガー名の集合。レコードごとに評価されるため、文字列比較ではなくハッシュ参照で判定する
+_FILTERED_LOGGERS = frozenset({"auto_gen_playlist.lastfm.requests"})
+
+
 class StreamHandlerFilter(Filter):
     def filter(self, record: LogRecord):
-        return "auto_gen_playlist.lastfm.requests" != record.name
+        return record.name not in _FILTERED_LOGGERS
 
 
 def load_config():
     dotenv.load_dotenv()  # type: ignore
 
     with open(LOG_CONF_PATH, "r", encoding="utf-8") as f:
-        yml = safe_load(f)
+        yml = yaml_load(f, Loader=YamlLoader)
     config.dictConfig(yml)
 
 
 async def main():
+    try:
+        await run()
+    finally:
+        await close_session()
+
+
+async def run():
     load_config()
-    sp = spotipy.Spotify(auth_manager=spotipy.oauth2.SpotifyOAuth(scope=SCOPE))
+    sp = create_spotify_client(SCOPE)
 
     print(
         "To create recommended playlists, enter a playlist URL.  To create top-track / first-listened playlists, press the enter key."  # noqa: E501
@@ -102,5 +121,6 @@ async def main():
 
 
 if __name__ == "__main__":
-    asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    if sys.platform == "win32":
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     asyncio.run(main())